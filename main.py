@@ -1,10 +1,24 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import JSONResponse, RedirectResponse
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.responses import ORJSONResponse, RedirectResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from redis.exceptions import RedisError
+import aiohttp
 from yt_dlp import YoutubeDL
+from yt_dlp.utils import DownloadError, ExtractorError
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import atexit
 import logging
+import orjson
+import os
+import re
+import redis.asyncio as redis
+import sys
+import threading
 import time
-from typing import Dict, Optional
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
 
 # ------------------ Logging ------------------
 logging.basicConfig(
@@ -18,7 +32,8 @@ logger = logging.getLogger("YouTubeMusicAPI")
 app = FastAPI(
     title="YouTube Music API",
     description="Backend for music streaming (WORKING VERSION)",
-    version="3.0.0"
+    version="3.0.0",
+    default_response_class=ORJSONResponse
 )
 
 app.add_middleware(
@@ -30,20 +45,31 @@ app.add_middleware(
 )
 
 # ------------------ YouTube DL Options ------------------
+# Set YDL_DEBUG=1 for yt-dlp's full debug output; otherwise only errors are logged
+YDL_DEBUG = bool(os.getenv("YDL_DEBUG"))
+ydl_logger = logging.getLogger("yt_dlp")
+ydl_logger.setLevel(logging.DEBUG if YDL_DEBUG else logging.WARNING)
+
 YDL_OPTS = {
-    "format": "bestaudio/best",
-    "quiet": False,
+    # Prefer audio-only streams; yt-dlp picks the best one and exposes it as info["url"]
+    "format": "bestaudio[vcodec=none]/bestaudio/best",
+    "quiet": not YDL_DEBUG,
     "noplaylist": True,
-    "extractaudio": True,
-    "audioformat": "mp3",
+    # We only read stream URLs, never download, so skip format probing and DASH manifests
+    "skip_download": True,
+    "check_formats": False,
+    "youtube_include_dash_manifest": False,
     "nocheckcertificate": True,
     "ignoreerrors": True,
-    "no_warnings": False,
+    "no_warnings": not YDL_DEBUG,
     "default_search": "auto",
     "source_address": "0.0.0.0",
     "forceip": 4,
     "cookiefile": "cookies.txt",
-    "verbose": True,
+    # Player JS and signature functions are cached on disk (yt-dlp's default dir unless overridden)
+    "cachedir": os.getenv("YDL_CACHE_DIR"),
+    "verbose": YDL_DEBUG,
+    "logger": ydl_logger,
     "extractor_args": {"youtube": {"player_client": ["android", "web"]}},
     "http_headers": {
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
@@ -58,141 +84,479 @@ YDL_OPTS = {
 
 # ------------------ Cache ------------------
 class AudioCache:
-    def __init__(self, max_size: int = 100, ttl: int = 1800):
-        self.cache: Dict[str, dict] = {}
+    """LRU cache with TTL, laid out as W-TinyLFU: a small window LRU in front of the main LRU.
+
+    Expiry uses the monotonic clock, so NTP adjustments can't revive or kill entries.
+
+    New videos always enter the window, so a fresh result is there for the /redirect or
+    range requests that follow its /play. A count-min sketch of request frequency
+    decides admission when an entry leaves the window: it only displaces the main
+    LRU victim if it has been requested at least as often, so bursts of one-off ids
+    can't flush out the popular tracks.
+    """
+    # One odd 64-bit multiplier per row; the top bits of hash * seed pick the column.
+    # hash((row, id)) looks like it varies per row but collides in every row at once.
+    SKETCH_SEEDS = (0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9, 0xD6E8FEB86659FD93)
+    SKETCH_BITS = 10  # 1024 columns
+
+    def __init__(self, max_size: int = 100, ttl: int = 1800, negative_ttl: int = 60):
+        # Most recently used entries live at the end of both dicts
+        if max_size < 2:
+            raise ValueError("max_size must be at least 2: the window and main LRU need a slot each")
+        self.window: OrderedDict[str, dict] = OrderedDict()
+        self.cache: OrderedDict[str, dict] = OrderedDict()
         self.max_size = max_size
+        self.window_size = max(1, max_size // 10)
+        self.main_size = max_size - self.window_size
         self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._lock = threading.Lock()
+        self._sketch = [[0] * (1 << self.SKETCH_BITS) for _ in self.SKETCH_SEEDS]
+        self._increments = 0
+        # Halve all counters this often so old popularity fades out
+        self._age_every = 10 * max_size
+
+    def _columns(self, video_id: str):
+        h = hash(video_id) & 0xFFFFFFFFFFFFFFFF
+        shift = 64 - self.SKETCH_BITS
+        return [((h * seed) & 0xFFFFFFFFFFFFFFFF) >> shift for seed in self.SKETCH_SEEDS]
+
+    def _touch(self, video_id: str):
+        for row, col in zip(self._sketch, self._columns(video_id)):
+            row[col] += 1
+        self._increments += 1
+        if self._increments >= self._age_every:
+            self._increments = 0
+            for row in self._sketch:
+                row[:] = [count >> 1 for count in row]
+
+    def _frequency(self, video_id: str) -> int:
+        return min(row[col] for row, col in zip(self._sketch, self._columns(video_id)))
+
+    def _find(self, video_id: str) -> Tuple[Optional[OrderedDict], Optional[dict]]:
+        """Return (segment, entry) for a live entry, dropping it if it has expired"""
+        for segment in (self.window, self.cache):
+            entry = segment.get(video_id)
+            if entry is not None:
+                if entry["expires_at"] <= time.monotonic():
+                    del segment[video_id]
+                    return None, None
+                return segment, entry
+        return None, None
 
     def get(self, video_id: str) -> Optional[dict]:
-        if video_id in self.cache:
-            entry = self.cache[video_id]
-            if time.time() - entry["timestamp"] < self.ttl:
-                return entry["data"]
-        return None
+        with self._lock:
+            # Every request is counted exactly once, here, whether it hits or misses
+            self._touch(video_id)
+            segment, entry = self._find(video_id)
+            if entry is None:
+                return None
+            segment.move_to_end(video_id)
+            return entry["data"]
+
+    def get_negative(self, video_id: str) -> Optional[str]:
+        """Return the 404 detail if this video recently failed to resolve"""
+        with self._lock:
+            _, entry = self._find(video_id)
+            return entry.get("negative") if entry else None
+
+    def set(self, video_id: str, data: dict, ttl: Optional[int] = None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        self._store(video_id, {"data": data}, ttl)
+
+    def set_negative(self, video_id: str, detail: str):
+        """Remember a failed lookup briefly so repeat requests don't re-run yt-dlp"""
+        self._store(video_id, {"data": None, "negative": detail}, self.negative_ttl)
 
-    def set(self, video_id: str, data: dict):
-        if len(self.cache) >= self.max_size:
-            self.cache.pop(next(iter(self.cache)))
-        self.cache[video_id] = {"data": data, "timestamp": time.time()}
+    def _store(self, video_id: str, fields: dict, ttl: int):
+        if ttl <= 0:
+            return
+        now = time.monotonic()
+        entry = {**fields, "expires_at": now + ttl}
+        with self._lock:
+            for segment in (self.cache, self.window):
+                if video_id in segment:
+                    segment[video_id] = entry
+                    segment.move_to_end(video_id)
+                    return
+            self.window[video_id] = entry
+            while len(self.window) > self.window_size:
+                candidate, candidate_entry = self.window.popitem(last=False)
+                self._admit(candidate, candidate_entry, now)
+
+    def _admit(self, video_id: str, entry: dict, now: float):
+        """Move an entry leaving the window into the main LRU if it has earned a slot"""
+        if entry["expires_at"] <= now:
+            return
+        if len(self.cache) >= self.main_size:
+            victim, victim_entry = next(iter(self.cache.items()))
+            victim_alive = victim_entry["expires_at"] > now
+            if victim_alive and self._frequency(video_id) < self._frequency(victim):
+                return
+            del self.cache[victim]
+        self.cache[video_id] = entry
+
+    def delete(self, video_id: str):
+        with self._lock:
+            self.window.pop(video_id, None)
+            self.cache.pop(video_id, None)
+
+    def sweep(self) -> int:
+        """Drop every expired entry and return how many were removed"""
+        now = time.monotonic()
+        removed = 0
+        with self._lock:
+            for segment in (self.window, self.cache):
+                expired = [vid for vid, entry in segment.items() if entry["expires_at"] <= now]
+                for vid in expired:
+                    del segment[vid]
+                removed += len(expired)
+        return removed
 
 audio_cache = AudioCache()
 
-# ------------------ ROUTES ------------------
+class SharedCache:
+    """Redis-backed cache shared by all workers; entries expire with their key"""
+    def __init__(self, url: str, prefix: str = "yt:", timeout: float = 0.5):
+        # Short socket timeouts so a stalled or unreachable Redis degrades to a miss
+        # instead of holding every request up
+        self.redis = redis.from_url(url, socket_timeout=timeout, socket_connect_timeout=timeout)
+        self.prefix = prefix
 
-@app.get("/")
-def root():
+    async def get(self, video_id: str) -> Tuple[Optional[dict], int]:
+        """Return (data, seconds left), fetching both in one round trip"""
+        key = self.prefix + video_id
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                raw, ttl = await pipe.get(key).ttl(key).execute()
+        except RedisError as e:
+            logger.warning(f"Redis get failed: {e}")
+            return None, 0
+        if not raw:
+            return None, 0
+        return orjson.loads(raw), ttl
+
+    async def set(self, video_id: str, data: dict, ttl: int):
+        if ttl <= 0:
+            return
+        try:
+            await self.redis.set(self.prefix + video_id, orjson.dumps(data), ex=ttl)
+        except RedisError as e:
+            logger.warning(f"Redis set failed: {e}")
+
+    async def delete(self, video_id: str):
+        try:
+            await self.redis.delete(self.prefix + video_id)
+        except RedisError as e:
+            logger.warning(f"Redis delete failed: {e}")
+
+# Optional second tier so every uvicorn worker sees the same cached videos
+REDIS_URL = os.getenv("REDIS_URL")
+shared_cache = SharedCache(REDIS_URL) if REDIS_URL else None
+
+@app.on_event("shutdown")
+async def close_shared_cache():
+    if shared_cache:
+        await shared_cache.redis.aclose()
+
+async def periodic_sweep():
+    """Free expired cache entries even if they are never requested again"""
+    while True:
+        await asyncio.sleep(audio_cache.ttl / 4)
+        removed = audio_cache.sweep()
+        if removed:
+            logger.info(f"Cache sweep removed {removed} expired entries")
+
+# Strong references to long-running tasks so they aren't garbage collected
+BACKGROUND_TASKS = set()
+
+def spawn(coro):
+    task = asyncio.create_task(coro)
+    BACKGROUND_TASKS.add(task)
+    task.add_done_callback(BACKGROUND_TASKS.discard)
+
+@app.on_event("startup")
+async def start_cache_sweeper():
+    spawn(periodic_sweep())
+
+# ------------------ HTTP Client ------------------
+# Pooled keep-alive sessions, created on startup because aiohttp sessions must be bound
+# to the running loop. Proxied streams hold their connection for minutes, so they get
+# their own pool and can't starve the short Innertube calls into timeouts.
+http_session: Optional[aiohttp.ClientSession] = None
+stream_session: Optional[aiohttp.ClientSession] = None
+
+@app.on_event("startup")
+async def open_http_session():
+    global http_session, stream_session
+    http_session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=100, keepalive_timeout=75),
+        timeout=aiohttp.ClientTimeout(total=10)
+    )
+    stream_session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=100, keepalive_timeout=75)
+    )
+
+@app.on_event("shutdown")
+async def close_http_session():
+    for session in (http_session, stream_session):
+        if session:
+            await session.close()
+
+# ------------------ Innertube ------------------
+# Fast path: ask YouTube's player API directly over async HTTP and only fall back to
+# yt-dlp (and a thread-pool slot) when that doesn't hand us a plain audio URL.
+# ANDROID_VR needs neither the JS player nor a PO token for direct stream URLs.
+USE_INNERTUBE = os.getenv("INNERTUBE", "1") != "0"
+INNERTUBE_URL = "https://www.youtube.com/youtubei/v1/player"
+INNERTUBE_CLIENT = {
+    "clientName": "ANDROID_VR",
+    "clientVersion": "1.65.10",
+    "deviceMake": "Oculus",
+    "deviceModel": "Quest 3",
+    "androidSdkVersion": 32,
+    "osName": "Android",
+    "osVersion": "12L",
+    "hl": "en",
+}
+INNERTUBE_HEADERS = {
+    "User-Agent": "com.google.android.apps.youtube.vr.oculus/1.65.10 "
+                  "(Linux; U; Android 12L; eureka-user Build/SQ3A.220605.009.A1) gzip",
+    "X-YouTube-Client-Name": "28",
+    "X-YouTube-Client-Version": INNERTUBE_CLIENT["clientVersion"],
+    "Origin": "https://www.youtube.com",
+}
+
+# Circuit breaker: after this many upstream failures in a row (transport errors, HTTP
+# errors, bot checks), skip Innertube for a cool-off window. Per-video misses don't count.
+INNERTUBE_MAX_FAILURES = 5
+INNERTUBE_COOLDOWN = 30
+_innertube_failures = 0
+_innertube_open_until = 0.0
+
+async def _innertube_info(video_id: str) -> Tuple[Optional[dict], bool]:
+    """Fetch video info from the player API, shaped like yt-dlp's info dict.
+
+    Returns (info, upstream_failed). upstream_failed is True only when Innertube itself
+    is unhealthy (transport or HTTP error, bot check), not when this video can't be served.
+    """
+    payload = {"context": {"client": INNERTUBE_CLIENT}, "videoId": video_id}
+    try:
+        async with http_session.post(INNERTUBE_URL, params={"prettyPrint": "false"},
+                                     json=payload, headers=INNERTUBE_HEADERS) as resp:
+            resp.raise_for_status()
+            data = await resp.json()
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+        logger.warning(f"Innertube request failed for {video_id}: {e}")
+        return None, True
+
+    playability = data.get("playabilityStatus", {})
+    if playability.get("status") != "OK":
+        # "Sign in to confirm you're not a bot" hits every video; ERROR, UNPLAYABLE and
+        # age/login checks are about this one
+        bot_check = "not a bot" in (playability.get("reason") or "").lower()
+        if bot_check:
+            logger.warning(f"Innertube bot check for {video_id}")
+        return None, bot_check
+    # One pass over the formats: highest bitrate wins, the larger stream breaks ties.
+    # Formats with a signatureCipher instead of a url need deciphering; leave those to yt-dlp.
+    best_rank, best_url = (-1, -1), None
+    for f in data.get("streamingData", {}).get("adaptiveFormats", ()):
+        url = f.get("url")
+        if not url or not f.get("mimeType", "").startswith("audio/"):
+            continue
+        rank = (f.get("bitrate") or 0, int(f.get("contentLength") or 0))
+        if rank > best_rank:
+            best_rank, best_url = rank, url
+    if not best_url:
+        return None, False
+
+    details = data.get("videoDetails", {})
+    thumbnails = details.get("thumbnail", {}).get("thumbnails") or [{}]
     return {
-        "message": "YouTube Music API is RUNNING!",
-        "usage": "Use /play/VIDEO_ID to get audio URL or /redirect/VIDEO_ID to play directly",
-        "example": "http://localhost:8000/play/dQw4w9WgXcQ"
-    }
+        "url": best_url,
+        "title": details.get("title", "Unknown Title"),
+        "uploader": details.get("author", "Unknown Artist"),
+        "duration": int(details.get("lengthSeconds") or 0),
+        "thumbnail": thumbnails[-1].get("url"),
+        "webpage_url": f"https://www.youtube.com/watch?v={video_id}",
+    }, False
 
-@app.get("/play/{video_id}")
-def get_audio_url(video_id: str):
-    """Get audio URL that works in browsers"""
+# ------------------ Extraction ------------------
+# yt-dlp is blocking, so extractions run in a bounded pool off the event loop
+YDL_WORKERS = int(os.getenv("YDL_WORKERS", "8"))
+EXECUTOR = ThreadPoolExecutor(max_workers=YDL_WORKERS)
+
+# One long-lived YoutubeDL per executor thread: building one loads cookies and every
+# extractor, and a YoutubeDL isn't safe to share between threads
+_ydl_local = threading.local()
+_ydl_pool = []
+
+def _get_ydl() -> YoutubeDL:
+    ydl = getattr(_ydl_local, "ydl", None)
+    if ydl is None:
+        ydl = _ydl_local.ydl = YoutubeDL(YDL_OPTS)
+        _ydl_pool.append(ydl)
+    return ydl
+
+@atexit.register
+def _close_ydl_pool():
+    for ydl in _ydl_pool:
+        ydl.close()
+
+def _extract(video_id: str) -> Optional[dict]:
+    """Run yt-dlp for a video and return its info dict (blocking)"""
+    url = f"https://www.youtube.com/watch?v={video_id}"
+    ydl = _get_ydl()
+    info = ydl.extract_info(url, download=False, process=False)
+    if not info:
+        return None
+    # Drop video streams before processing so yt-dlp only sorts and selects among audio ones
+    audio_formats = [f for f in info.get("formats") or () if f.get("vcodec") == "none" and f.get("acodec") != "none"]
+    if audio_formats:
+        info["formats"] = audio_formats
+    # ignoreerrors only guards extract_info, so format-selection failures (e.g. only
+    # storyboards left when streams need a PO token) must be turned into a miss here
     try:
-        # Check cache first
-        cached = audio_cache.get(video_id)
+        return ydl.process_ie_result(info, download=False)
+    except (DownloadError, ExtractorError) as e:
+        logger.warning(f"yt-dlp could not select a format for {video_id}: {e}")
+        return None
+
+async def _lookup(video_id: str) -> Optional[dict]:
+    """Try the Innertube fast path, then fall back to a full yt-dlp extraction"""
+    global _innertube_failures, _innertube_open_until
+    if USE_INNERTUBE and time.monotonic() >= _innertube_open_until:
+        info, upstream_failed = await _innertube_info(video_id)
+        if info:
+            _innertube_failures = 0
+            return info
+        if upstream_failed:
+            _innertube_failures += 1
+        if _innertube_failures >= INNERTUBE_MAX_FAILURES:
+            logger.warning(f"Innertube failed {_innertube_failures} times in a row; using yt-dlp for {INNERTUBE_COOLDOWN}s")
+            _innertube_failures = 0
+            _innertube_open_until = time.monotonic() + INNERTUBE_COOLDOWN
+    return await asyncio.get_running_loop().run_in_executor(EXECUTOR, _extract, video_id)
+
+# Extractions in progress, so concurrent requests for one video share a single lookup
+INFLIGHT: Dict[str, asyncio.Future] = {}
+
+async def _fetch_info(video_id: str) -> Optional[dict]:
+    """Extract video info, joining an in-flight extraction for the same id if there is one"""
+    fut = INFLIGHT.get(video_id)
+    if fut is None:
+        # No await between the lookup and the insert, so this is atomic on the event loop
+        fut = asyncio.ensure_future(_lookup(video_id))
+        INFLIGHT[video_id] = fut
+        fut.add_done_callback(lambda _: INFLIGHT.pop(video_id, None))
+    # Shield so one client disconnecting doesn't cancel the extraction for everyone else
+    return await asyncio.shield(fut)
+
+def _url_ttl(audio_url: str) -> Optional[int]:
+    """Seconds until a signed googlevideo URL expires, minus a safety margin"""
+    expire = parse_qs(urlparse(audio_url).query).get("expire")
+    if not expire or not expire[0].isdigit():
+        return None
+    return int(expire[0]) - int(time.time()) - 60
+
+def _not_found(video_id: str, detail: str) -> HTTPException:
+    audio_cache.set_negative(video_id, detail)
+    return HTTPException(status_code=404, detail=detail)
+
+async def _resolve(video_id: str) -> Tuple[dict, bool]:
+    """Return (result, cached) for a video, extracting and caching it on a miss"""
+    cached = audio_cache.get(video_id)
+    if cached:
+        return cached, True
+    negative = audio_cache.get_negative(video_id)
+    if negative:
+        raise HTTPException(status_code=404, detail=negative)
+
+    if shared_cache:
+        cached, ttl = await shared_cache.get(video_id)
         if cached:
-            return JSONResponse(content={**cached, "cached": True})
-
-        logger.info(f"Fetching audio URL for: {video_id}")
-        url = f"https://www.youtube.com/watch?v={video_id}"
-        
-        with YoutubeDL(YDL_OPTS) as ydl:
-            info = ydl.extract_info(url, download=False)
-            
-            if not info:
-                raise HTTPException(status_code=404, detail="Video not found")
-            
-            # Get the best audio URL
-            audio_url = info.get('url')
-            formats = info.get('formats', [])
-            
-            # If no direct URL, find the best audio format
-            if not audio_url and formats:
-                # Look for audio-only formats
-                audio_formats = [f for f in formats if f.get('acodec') != 'none' and f.get('vcodec') == 'none']
-                if audio_formats:
-                    # Sort by bitrate (highest first)
-                    audio_formats.sort(key=lambda x: x.get('abr', 0) or 0, reverse=True)
-                    audio_url = audio_formats[0].get('url')
-                else:
-                    # Fallback to any format with audio
-                    for f in formats:
-                        if f.get('acodec') != 'none':
-                            audio_url = f.get('url')
-                            break
-            
-            if not audio_url:
-                raise HTTPException(status_code=404, detail="No audio stream found")
-            
-            # Prepare response
-            result = {
-                "video_id": video_id,
-                "title": info.get('title', 'Unknown Title'),
-                "artist": info.get('uploader', 'Unknown Artist'),
-                "duration": info.get('duration', 0),
-                "audio_url": audio_url,
-                "thumbnail": info.get('thumbnail'),
-                "webpage_url": info.get('webpage_url'),
-                "success": True,
-                "message": "Copy the audio_url and paste in browser address bar to play"
-            }
-            
-            # Cache the result
-            audio_cache.set(video_id, result)
-            
-            return JSONResponse(content={**result, "cached": False})
-            
-    except Exception as e:
-        logger.error(f"Error: {e}")
-        raise HTTPException(status_code=500, detail=f"Failed to get audio: {str(e)}")
+            audio_cache.set(video_id, cached, ttl=ttl)
+            return cached, True
 
-@app.get("/redirect/{video_id}")
-def redirect_to_audio(video_id: str):
-    """Redirect directly to audio stream (BEST FOR BROWSER PLAYBACK)"""
+    logger.info(f"Fetching audio URL for: {video_id}")
+    info = await _fetch_info(video_id)
+    
+    if not info:
+        raise _not_found(video_id, "Video not found")
+    
+    # The format selector has already picked the best audio stream
+    audio_url = info.get('url')
+    if not audio_url:
+        raise _not_found(video_id, "No audio stream found")
+    
+    result = {
+        "video_id": video_id,
+        "title": info.get('title', 'Unknown Title'),
+        "artist": info.get('uploader', 'Unknown Artist'),
+        "duration": info.get('duration', 0),
+        "audio_url": audio_url,
+        "thumbnail": info.get('thumbnail'),
+        "webpage_url": info.get('webpage_url'),
+        "success": True,
+        "message": "Copy the audio_url and paste in browser address bar to play"
+    }
+    
+    # Never keep a result around longer than its stream URL stays valid
+    url_ttl = _url_ttl(audio_url)
+    ttl = audio_cache.ttl if url_ttl is None else min(url_ttl, audio_cache.ttl)
+    audio_cache.set(video_id, result, ttl=ttl)
+    if shared_cache:
+        await shared_cache.set(video_id, result, ttl)
+    return result, False
+
+# Extracted once on every executor thread at startup: each thread's YoutubeDL keeps its own
+# player cache, so otherwise each thread's first fallback pays for loading the player JS.
+# Goes straight to yt-dlp: the caches or Innertube answering would leave it cold.
+WARMUP_VIDEO_ID = os.getenv("WARMUP_VIDEO_ID", "dQw4w9WgXcQ")
+
+def _warm_thread(barrier: threading.Barrier) -> Optional[dict]:
+    # Hold each job until all have started so they land on distinct threads; the timeout
+    # stops requests already occupying threads from keeping the rest waiting
     try:
-        logger.info(f"Redirecting to audio for: {video_id}")
-        url = f"https://www.youtube.com/watch?v={video_id}"
-        
-        with YoutubeDL(YDL_OPTS) as ydl:
-            info = ydl.extract_info(url, download=False)
-            
-            if not info:
-                raise HTTPException(status_code=404, detail="Video not found")
-            
-            audio_url = info.get('url')
-            formats = info.get('formats', [])
-            
-            # Find best audio URL
-            if not audio_url and formats:
-                audio_formats = [f for f in formats if f.get('acodec') != 'none' and f.get('vcodec') == 'none']
-                if audio_formats:
-                    audio_formats.sort(key=lambda x: x.get('abr', 0) or 0, reverse=True)
-                    audio_url = audio_formats[0].get('url')
-            
-            if not audio_url:
-                raise HTTPException(status_code=404, detail="No audio stream found")
-            
-            # Redirect to the audio URL
-            response = RedirectResponse(url=audio_url)
-            
-            # Add headers that YouTube expects
-            response.headers["User-Agent"] = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
-            response.headers["Referer"] = "https://www.youtube.com/"
-            response.headers["Origin"] = "https://www.youtube.com"
-            
-            return response
-            
-    except Exception as e:
-        logger.error(f"Redirect error: {e}")
-        raise HTTPException(status_code=500, detail=f"Redirect failed: {str(e)}")
+        barrier.wait()
+    except threading.BrokenBarrierError:
+        pass
+    return _extract(WARMUP_VIDEO_ID)
 
-@app.get("/test/{video_id}")
-def test_playback(video_id: str):
-    """Simple test endpoint that returns HTML to play audio"""
-    html_content = f"""
+async def warm_extractor():
+    loop = asyncio.get_running_loop()
+    barrier = threading.Barrier(YDL_WORKERS, timeout=10)
+    results = await asyncio.gather(
+        *(loop.run_in_executor(EXECUTOR, _warm_thread, barrier) for _ in range(YDL_WORKERS)),
+        return_exceptions=True
+    )
+    warmed = sum(1 for r in results if r and not isinstance(r, BaseException))
+    if warmed == YDL_WORKERS:
+        logger.info("yt-dlp warmed up")
+        return
+    error = next((r for r in results if isinstance(r, BaseException)), None)
+    reason = error if error else f"no info for {WARMUP_VIDEO_ID}"
+    logger.warning(f"yt-dlp warmup incomplete ({warmed}/{YDL_WORKERS} threads): {reason}")
+
+@app.on_event("startup")
+async def start_warmup():
+    # Runs in the background so a slow YouTube can't hold up startup
+    if WARMUP_VIDEO_ID:
+        spawn(warm_extractor())
+
+# ------------------ Validation ------------------
+VIDEO_ID_RE = re.compile(r"[A-Za-z0-9_-]{11}")
+
+def check_id(video_id: str) -> str:
+    """Reject anything that isn't a YouTube video id before it reaches yt-dlp"""
+    # fullmatch, because "$" would also accept an id followed by a newline
+    if not VIDEO_ID_RE.fullmatch(video_id):
+        raise HTTPException(status_code=400, detail="Invalid video id")
+    return video_id
+
+# ------------------ Test Page ------------------
+TEST_HTML = """
     <!DOCTYPE html>
     <html>
     <head>
@@ -210,20 +574,153 @@ def test_playback(video_id: str):
     </body>
     </html>
     """
-    from fastapi.responses import HTMLResponse
-    return HTMLResponse(content=html_content)
+# Encoded once; each request just joins the pieces around the video id
+TEST_HTML_PARTS = tuple(part.encode() for part in TEST_HTML.split("{video_id}"))
+
+# ------------------ Errors ------------------
+@app.exception_handler(Exception)
+async def unhandled_error(request: Request, exc: Exception):
+    # HTTPExceptions (404 etc.) never reach here; the server logs the traceback after this returns.
+    # The exception text stays in the log: it can be a long yt-dlp message full of internals.
+    logger.error(f"Unhandled error on {request.url.path}: {exc}")
+    return ORJSONResponse(status_code=500, content={"detail": "Internal server error"})
+
+# ------------------ ROUTES ------------------
+
+@app.get("/")
+def root():
+    return {
+        "message": "YouTube Music API is RUNNING!",
+        "usage": "Use /play/VIDEO_ID to get audio URL, /redirect/VIDEO_ID to play directly "
+                 "or /stream/VIDEO_ID to play through this server",
+        "example": "http://localhost:8000/play/dQw4w9WgXcQ"
+    }
+
+@app.get("/play/{video_id}")
+async def get_audio_url(video_id: str = Depends(check_id)):
+    """Get audio URL that works in browsers"""
+    result, cached = await _resolve(video_id)
+    return ORJSONResponse(content={**result, "cached": cached})
+
+@app.get("/redirect/{video_id}")
+async def redirect_to_audio(video_id: str = Depends(check_id)):
+    """Redirect directly to audio stream (BEST FOR BROWSER PLAYBACK)"""
+    logger.info(f"Redirecting to audio for: {video_id}")
+    # Shares the /play cache, so seeks and retries from <audio> skip yt-dlp
+    result, _ = await _resolve(video_id)
+    
+    # Redirect to the audio URL
+    response = RedirectResponse(url=result["audio_url"])
+    
+    # Add headers that YouTube expects
+    response.headers["User-Agent"] = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
+    response.headers["Referer"] = "https://www.youtube.com/"
+    response.headers["Origin"] = "https://www.youtube.com"
+    
+    return response
+
+# Streams can run for minutes, so only bound getting a connection (including waiting
+# for a free slot in the pool) and each read
+STREAM_TIMEOUT = aiohttp.ClientTimeout(total=None, connect=15, sock_connect=10, sock_read=30)
+STREAM_HEADERS = {
+    "User-Agent": YDL_OPTS["http_headers"]["User-Agent"],
+    "Referer": "https://www.youtube.com/",
+    "Origin": "https://www.youtube.com",
+}
+# Forwarded both ways so seeking with Range requests works through the proxy
+STREAM_PASSTHROUGH = ("Content-Length", "Content-Range", "Accept-Ranges")
+# googlevideo's answer to an expired or revoked signed URL
+DEAD_URL_STATUSES = (403, 410)
+
+async def _invalidate(video_id: str):
+    """Forget a cached result whose stream URL stopped working, in both cache tiers"""
+    audio_cache.delete(video_id)
+    if shared_cache:
+        await shared_cache.delete(video_id)
+
+async def _open_stream(audio_url: str, byte_range: Optional[str]) -> aiohttp.ClientResponse:
+    headers = dict(STREAM_HEADERS)
+    if byte_range:
+        headers["Range"] = byte_range
+    try:
+        return await stream_session.get(audio_url, headers=headers, timeout=STREAM_TIMEOUT)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        raise HTTPException(status_code=502, detail=f"Audio stream unavailable: {e}")
+
+async def _relay(upstream: aiohttp.ClientResponse):
+    try:
+        async for chunk in upstream.content.iter_chunked(65536):
+            yield chunk
+    finally:
+        upstream.release()
+
+@app.get("/stream/{video_id}")
+async def stream_audio(request: Request, video_id: str = Depends(check_id)):
+    """Proxy the audio stream for clients that can't follow /redirect (CORS, Referer checks)"""
+    byte_range = request.headers.get("range")
+    result, cached = await _resolve(video_id)
+    upstream = await _open_stream(result["audio_url"], byte_range)
+
+    if upstream.status in DEAD_URL_STATUSES:
+        upstream.release()
+        # Drop the dead URL so /redirect and later streams don't keep serving it
+        await _invalidate(video_id)
+        if cached:
+            # Only a cached URL can have gone stale; resolve a fresh one and try once more
+            result, _ = await _resolve(video_id)
+            upstream = await _open_stream(result["audio_url"], byte_range)
+            if upstream.status in DEAD_URL_STATUSES:
+                await _invalidate(video_id)
+    if upstream.status == 416:
+        upstream.release()
+        # A seek past the end is the client's mistake, not an upstream failure; hand back
+        # the Content-Range so it can see the real length
+        content_range = upstream.headers.get("Content-Range")
+        return Response(status_code=416, headers={"Content-Range": content_range} if content_range else None)
+
+    if upstream.status >= 400:
+        upstream.release()
+        raise HTTPException(status_code=502, detail=f"Audio stream returned {upstream.status}")
+
+    return StreamingResponse(
+        _relay(upstream),
+        status_code=upstream.status,
+        media_type=upstream.headers.get("Content-Type"),
+        headers={k: upstream.headers[k] for k in STREAM_PASSTHROUGH if k in upstream.headers}
+    )
+
+@app.get("/test/{video_id}")
+def test_playback(video_id: str = Depends(check_id)):
+    """Simple test endpoint that returns HTML to play audio"""
+    # check_id guarantees a plain ASCII id, so it needs no escaping
+    return Response(
+        content=video_id.encode().join(TEST_HTML_PARTS),
+        media_type="text/html",
+        # The page only depends on the id, so browsers can keep it for an hour
+        headers={"Cache-Control": "public, max-age=3600"}
+    )
 
 # ------------------ START THE SERVER ------------------
 if __name__ == "__main__":
     import uvicorn
-    import os
+    port = int(os.getenv("PORT", "8000"))
     print("🧠 Cookie file exists:", os.path.exists("cookies.txt"))
     print("🎵 YouTube Music API Starting...")
     print("📢 Use these URLs in your browser:")
-    print("   http://localhost:8000/play/dQw4w9WgXcQ")
-    print("   http://localhost:8000/redirect/dQw4w9WgXcQ")
-    print("   http://localhost:8000/test/dQw4w9WgXcQ")
-    uvicorn.run(app, host="0.0.0.0", port=8000, log_level="info")
+    print(f"   http://localhost:{port}/play/dQw4w9WgXcQ")
+    print(f"   http://localhost:{port}/redirect/dQw4w9WgXcQ")
+    print(f"   http://localhost:{port}/stream/dQw4w9WgXcQ")
+    print(f"   http://localhost:{port}/test/dQw4w9WgXcQ")
+    # Each worker is its own process with its own YoutubeDL pool, AudioCache and INFLIGHT map
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=port,
+        workers=int(os.getenv("WORKERS", os.cpu_count() or 2)),
+        loop="asyncio" if sys.platform == "win32" else "uvloop",  # uvloop has no Windows build
+        http="httptools",
+        log_level="info"
+    )
 
 
 